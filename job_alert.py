@@ -1,15 +1,43 @@
 import os
 import re
+import csv
+import gzip
+import heapq
 import time
+import zlib
+import hashlib
+import sqlite3
+import functools
 import urllib.parse
 import requests
 import smtplib
 import ssl
+import threading
 from email.message import EmailMessage
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import List, Dict, Any
-from openpyxl import Workbook
-from openpyxl.styles import Font
+from operator import attrgetter, itemgetter
+from typing import List, Dict, Any, Optional, Tuple
+import xlsxwriter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is much faster on large SerpAPI payloads; stdlib json keeps the script working without it
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False).encode()
 
 # ============== ENV (GitHub Secrets) ==============
 SERPAPI_KEY = os.getenv("SERPAPI_KEY")
@@ -24,6 +52,28 @@ EMAIL_RECEIVERS = [e.strip() for e in (os.getenv("EMAIL_RECEIVER") or "").split(
 
 LOCATION = "United States"
 
+# "xlsx" (default, formatted links) or "csv" (gzip-compressed, much faster to build and send)
+OUTPUT_FORMAT = (os.getenv("OUTPUT_FORMAT") or "xlsx").strip().lower()
+
+# Max SerpAPI requests in flight at once (query fan-out and listing enrichment)
+SERPAPI_CONCURRENCY = max(1, int(os.getenv("SERPAPI_CONCURRENCY") or "20"))
+# Client-side request rate cap (requests/second), sized to the SerpAPI plan
+SERPAPI_QPS = float(os.getenv("SERPAPI_QPS") or "10")
+if not SERPAPI_QPS > 0:  # also rejects nan
+    raise ValueError("SERPAPI_QPS must be a positive number.")
+# Wall-clock budget for all SerpAPI fetching; calls not started by then are cancelled and
+# running queries stop paging, keeping the pages they already have
+MAX_RUNTIME_SECONDS = int(os.getenv("MAX_RUNTIME_SECONDS") or "1200")
+
+# On-disk SerpAPI response cache (restored between workflow runs by actions/cache)
+SERPAPI_CACHE_PATH = os.getenv("SERPAPI_CACHE_PATH", "serpapi_cache.sqlite")
+SERPAPI_CACHE_TTL = 6 * 60 * 60  # seconds
+# Listing details (pay, links) barely change over a posting's lifetime, so listing responses
+# live much longer; their relative posted_at is aged by the time since the fetch when read
+SERPAPI_LISTING_CACHE_TTL = 14 * 24 * 60 * 60  # seconds
+# An expired entry younger than this is still served if the live request fails
+SERPAPI_CACHE_MAX_STALE = 24 * 60 * 60  # seconds
+
 ROLE_KEYWORDS = [
     "Quality Assurance Supervisor",
     "Quality Assurance Manager",
@@ -43,11 +93,80 @@ ROLE_KEYWORDS = [
     "Quality Lead",
 ]
 
+# OR-ed together as the food clause of every query. "food processing" was dropped: its
+# results are largely covered by plain "food". Check QUERY_YIELD_LOG before pruning further.
+HINT_MODIFIERS = ("food", "food manufacturing", "HACCP", "SQF", "FSQA")
+
+# Roles are OR-ed into groups of this size, one query per group. Google ignores query words
+# past ~32, so one query with all 16 roles would silently drop most of them. Set
+# ROLE_GROUP_SIZE=16 to run a single big query once its coverage has been checked.
+ROLE_GROUP_SIZE = max(1, int(os.getenv("ROLE_GROUP_SIZE") or "4"))
+# Rich OR queries are paginated deeper instead of issuing many shallow queries
+MAX_PAGES = int(os.getenv("MAX_PAGES") or "10")
+# google_jobs returns at most this many results per page; a shorter page is the last one
+JOBS_PAGE_SIZE = 10
+
+# The report keeps at most this many of the newest jobs
+REPORT_MAX_ROWS = int(os.getenv("REPORT_MAX_ROWS") or "500")
+
+# Digest of the last emailed report; an identical result set is not re-sent
+REPORT_HASH_PATH = os.getenv("REPORT_HASH_PATH", ".last_report.hash")
+
+# Per-query yield (results returned / new unique jobs kept), appended on every run
+QUERY_YIELD_LOG = os.getenv("QUERY_YIELD_LOG", "query_yield.csv")
+
 FOOD_HINTS = [
     "food", "food manufacturing", "food processing", "meat", "dairy", "bakery", "beverage",
     "plant", "production", "warehouse", "HACCP", "SQF", "FSQA", "GMP", "sanitation"
 ]
 
+# Lowercased once at import. Hints that contain a shorter hint (e.g. "food processing" vs "food")
+# are redundant for an any-substring test, so they are dropped from the scan
+_FOOD_HINTS_LOWER = [h.lower() for h in FOOD_HINTS]
+FOOD_HINT_NEEDLES = tuple(
+    h for h in _FOOD_HINTS_LOWER if not any(o != h and o in h for o in _FOOD_HINTS_LOWER)
+)
+
+REPORT_HEADERS = [
+    "title",
+    "company_name",
+    "pay",
+    "time_posted",
+    "location",
+    "source",
+    "apply_link",
+    "source_link",
+    "company_careers_link",
+]
+
+# Pulls the report columns off a JobRow in header order
+report_values = attrgetter(*REPORT_HEADERS)
+
+REPORT_LINK_COLUMNS = frozenset(
+    REPORT_HEADERS.index(h) for h in ("apply_link", "source_link", "company_careers_link")
+)
+
+# Built once at import instead of on every send
+SMTP_SSL_CONTEXT = ssl.create_default_context()
+# Bounds the connect, TLS handshake and every later SMTP command
+SMTP_TIMEOUT = 30  # seconds
+
+ATTACHMENT_SUBTYPES = {
+    ".xlsx": "vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".gz": "gzip",
+}
+
+# Title abbreviations folded before near-duplicate comparison ("Sr. QA Mgr" == "Senior QA Manager")
+_TITLE_ABBREVIATIONS = {
+    "sr": "senior", "snr": "senior", "jr": "junior", "mgr": "manager",
+    "supv": "supervisor", "asst": "assistant", "assoc": "associate", "spec": "specialist",
+}
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+# "<n> <unit>" in one pass; the unit picks the day multiplier
+_AGE_RE = re.compile(r"(\d+)\s+(min|hour|day|week)")
+_AGE_UNIT_DAYS = {"min": 0, "hour": 0, "day": 1, "week": 7}
+
 
 def validate_env():
     if not SERPAPI_KEY:
@@ -56,8 +175,140 @@ def validate_env():
         raise ValueError("EMAIL_SENDER / EMAIL_PASSWORD / EMAIL_RECEIVER missing (GitHub Secrets).")
 
 
+# ---------------- SerpAPI response cache ----------------
+_cache_lock = threading.Lock()
+_cache_conn: Optional[sqlite3.Connection] = None
+
+
+def cache_db() -> sqlite3.Connection:
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(SERPAPI_CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS serpapi_cache (key TEXT PRIMARY KEY, ts INTEGER, payload BLOB)"
+        )
+    return _cache_conn
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    # api_key is left out so a rotated key still hits the cache
+    public = {k: v for k, v in params.items() if k != "api_key"}
+    return hashlib.sha1(json_dumps(public, sort_keys=True)).hexdigest()
+
+
+def cached_payload(hit: Tuple[int, bytes]) -> Dict[str, Any]:
+    # "fetched_at" (epoch seconds) lets readers age relative fields such as posted_at
+    data = json_loads(zlib.decompress(hit[1]))
+    data["fetched_at"] = hit[0]
+    return data
+
+
+def serpapi_cached(fetch):
+    @functools.wraps(fetch)
+    def wrapper(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = cache_key(params)
+        with _cache_lock:
+            hit = cache_db().execute("SELECT ts, payload FROM serpapi_cache WHERE key = ?", (key,)).fetchone()
+        age = time.time() - hit[0] if hit else None
+        ttl = SERPAPI_LISTING_CACHE_TTL if params.get("engine") == "google_jobs_listing" else SERPAPI_CACHE_TTL
+        if age is not None and age < ttl:
+            return cached_payload(hit)
+
+        data = fetch(params)
+        if data is None and age is not None and age < SERPAPI_CACHE_MAX_STALE:
+            return cached_payload(hit)  # stale-if-error
+        if data is not None:  # failures are never cached
+            now = int(time.time())
+            with _cache_lock:
+                db = cache_db()
+                db.execute(
+                    "INSERT OR REPLACE INTO serpapi_cache (key, ts, payload) VALUES (?, ?, ?)",
+                    (key, now, zlib.compress(json_dumps(data))),
+                )
+            data["fetched_at"] = now
+        return data
+
+    return wrapper
+
+
+def cache_commit() -> None:
+    # Writes are batched into one transaction, committed once fetching is done. Entries
+    # nothing can serve any more are evicted in the same transaction; paged results are
+    # keyed by a next_page_token that changes every run, so they would otherwise pile up.
+    max_age = max(SERPAPI_CACHE_TTL, SERPAPI_LISTING_CACHE_TTL, SERPAPI_CACHE_MAX_STALE)
+    with _cache_lock:
+        if _cache_conn is not None:
+            _cache_conn.execute("DELETE FROM serpapi_cache WHERE ts < ?", (int(time.time() - max_age),))
+            _cache_conn.commit()
+
+
 # ---------------- SerpAPI calls with retry/backoff ----------------
-def serpapi_google_jobs(query: str, location: str, num: int = 50) -> List[Dict[str, Any]]:
+# One pooled session for every call; urllib3 handles backoff and honours Retry-After
+SERPAPI_RETRY = Retry(
+    total=5,
+    backoff_factor=1,
+    backoff_jitter=0.5,
+    status_forcelist={429, 502, 503, 504},
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+SESSION = requests.Session()
+SESSION.headers.update({"Accept-Encoding": "gzip, deflate", "User-Agent": "job-alerts/1.0"})
+# serpapi.com is the only host (one pool); one connection per concurrent slot, so no worker
+# ever finds the pool full and has to redo the TLS handshake
+SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=SERPAPI_CONCURRENCY, max_retries=SERPAPI_RETRY),
+)
+
+# Shared across every worker thread so all phases together stay within the quota
+SERPAPI_SLOTS = threading.BoundedSemaphore(SERPAPI_CONCURRENCY)
+
+
+class TokenBucket:
+    # Thread-safe token bucket: allows bursts up to `capacity`, refills at `rate` tokens/second
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Keeps the concurrent fan-out under the account's QPS instead of bouncing off 429 backoff.
+# Capacity is at least one token, or a sub-1 QPS plan could never afford a request.
+SERPAPI_RATE_LIMIT = TokenBucket(rate=SERPAPI_QPS, capacity=max(1.0, SERPAPI_QPS))
+
+
+@serpapi_cached
+def serpapi_search(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        SERPAPI_RATE_LIMIT.acquire()
+        with SERPAPI_SLOTS:
+            r = SESSION.get("https://serpapi.com/search", params=params, timeout=30)
+        if r.status_code != 200:
+            return None
+        return json_loads(r.content)
+    except (requests.RequestException, ValueError):  # ValueError covers both JSONDecodeErrors
+        return None
+
+
+def serpapi_google_jobs(
+    query: str, location: str, num: int = 50, pages: int = 1, deadline: Optional[float] = None
+) -> List[Dict[str, Any]]:
     params = {
         "engine": "google_jobs",
         "q": query,
@@ -66,51 +317,32 @@ def serpapi_google_jobs(query: str, location: str, num: int = 50) -> List[Dict[s
         "num": num,
     }
 
-    retry_statuses = {429, 502, 503, 504}
-    max_attempts = 5
-
-    for attempt in range(1, max_attempts + 1):
-        try:
-            r = requests.get("https://serpapi.com/search", params=params, timeout=30)
-
-            if r.status_code in retry_statuses:
-                time.sleep(2 ** attempt)
-                continue
-
-            r.raise_for_status()
-            return r.json().get("jobs_results", []) or []
-
-        except requests.RequestException:
-            time.sleep(2 ** attempt)
-
-    return []
-
-
+    jobs: List[Dict[str, Any]] = []
+    for _ in range(pages):
+        data = serpapi_search(params) or {}
+        page_jobs = data.get("jobs_results", []) or []
+        jobs.extend(page_jobs)
+
+        # google_jobs pages with next_page_token; no token or a short page means this was the last one
+        token = (data.get("serpapi_pagination") or {}).get("next_page_token")
+        if len(page_jobs) < JOBS_PAGE_SIZE or not token:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        params = {**params, "next_page_token": token}
+    return jobs
+
+
+# At most one listing fetch per job_id per process. The dict is shared between callers,
+# so treat it as read-only (apply_details only reads from it).
+@functools.lru_cache(maxsize=4096)
 def serpapi_google_jobs_listing(job_id: str) -> Dict[str, Any]:
     if not job_id:
         return {}
 
     params = {"engine": "google_jobs_listing", "job_id": job_id, "api_key": SERPAPI_KEY}
-    retry_statuses = {429, 502, 503, 504}
-    max_attempts = 4
 
-    for attempt in range(1, max_attempts + 1):
-        try:
-            r = requests.get("https://serpapi.com/search", params=params, timeout=30)
-
-            if r.status_code in retry_statuses:
-                time.sleep(2 ** attempt)
-                continue
-
-            if r.status_code != 200:
-                return {}
-
-            return r.json() or {}
-
-        except requests.RequestException:
-            time.sleep(2 ** attempt)
-
-    return {}
+    return serpapi_search(params) or {}
 
 
 # ---------------- Helpers ----------------
@@ -146,17 +378,29 @@ def safe_source_link_from_details(details: Dict[str, Any]) -> str:
     return "N/A"
 
 
-def safe_pay(job: Dict[str, Any]) -> str:
+def safe_pay_and_time_posted(job: Dict[str, Any]) -> Tuple[str, str]:
     de = job.get("detected_extensions") or {}
-    if isinstance(de, dict) and de.get("salary"):
-        return str(de["salary"])
+    if not isinstance(de, dict):
+        de = {}
+    pay = str(de["salary"]) if de.get("salary") else "N/A"
+    time_posted = str(de["posted_at"]) if de.get("posted_at") else "N/A"
 
+    # One walk over extensions fills whichever of the two is still missing
     ext = job.get("extensions") or []
     if isinstance(ext, list):
         for item in ext:
-            if isinstance(item, str) and ("$" in item or "hour" in item.lower() or "year" in item.lower()):
-                return item
-    return "N/A"
+            if pay != "N/A" and time_posted != "N/A":
+                break
+            if not isinstance(item, str):
+                continue
+            il = item.lower()
+            if pay == "N/A" and ("$" in item or "hour" in il or "year" in il):
+                pay = item
+            if time_posted == "N/A" and (
+                "ago" in il or "today" in il or "yesterday" in il or "posted" in il
+            ):
+                time_posted = item
+    return pay, time_posted
 
 
 def safe_pay_from_details(details: Dict[str, Any]) -> str:
@@ -166,29 +410,25 @@ def safe_pay_from_details(details: Dict[str, Any]) -> str:
     return "N/A"
 
 
-def safe_time_posted(job: Dict[str, Any]) -> str:
-    de = job.get("detected_extensions") or {}
-    if isinstance(de, dict) and de.get("posted_at"):
-        return str(de["posted_at"])
-
-    ext = job.get("extensions") or []
-    if isinstance(ext, list):
-        for item in ext:
-            if isinstance(item, str) and (
-                "ago" in item.lower() or "today" in item.lower() or
-                "yesterday" in item.lower() or "posted" in item.lower()
-            ):
-                return item
-    return "N/A"
-
-
 def safe_time_posted_from_details(details: Dict[str, Any]) -> str:
     de = details.get("detected_extensions") or {}
     if isinstance(de, dict) and de.get("posted_at"):
-        return str(de["posted_at"])
+        return aged_time_posted(str(de["posted_at"]), details.get("fetched_at"))
     return "N/A"
 
 
+def aged_time_posted(time_posted: str, fetched_at: Optional[int]) -> str:
+    # posted_at ("2 days ago") is relative to the fetch, and a cached listing may be days old
+    elapsed = int((time.time() - fetched_at) // 86400) if fetched_at else 0
+    days = posted_days(time_posted)
+    if elapsed <= 0 or days == 999:
+        return time_posted
+    days += elapsed
+    return f"{days} day ago" if days == 1 else f"{days} days ago"
+
+
+# time_posted strings repeat heavily across jobs ("2 days ago", "today"), so parse each once
+@functools.lru_cache(maxsize=4096)
 def posted_days(time_posted: str) -> int:
     if not time_posted or time_posted == "N/A":
         return 999
@@ -199,18 +439,10 @@ def posted_days(time_posted: str) -> int:
     if "yesterday" in s:
         return 1
 
-    if re.search(r"\d+\s+hour", s):
-        return 0
-
-    m = re.search(r"(\d+)\s+day", s)
-    if m:
-        return int(m.group(1))
-
-    m = re.search(r"(\d+)\s+week", s)
-    if m:
-        return int(m.group(1)) * 7
-
-    return 999
+    m = _AGE_RE.search(s)
+    if not m:
+        return 999
+    return int(m.group(1)) * _AGE_UNIT_DAYS[m.group(2)]
 
 
 def looks_food_industry(job: Dict[str, Any]) -> bool:
@@ -219,9 +451,11 @@ def looks_food_industry(job: Dict[str, Any]) -> bool:
         str(job.get("company_name") or ""),
         str(job.get("description") or ""),
     ]).lower()
-    return any(h.lower() in text for h in FOOD_HINTS)
+    return any(h in text for h in FOOD_HINT_NEEDLES)
 
 
+# Pure function of the company name, and companies repeat across queries and pages
+@functools.lru_cache(maxsize=4096)
 def company_careers_search_link(company_name: str) -> str:
     if not company_name or company_name == "N/A":
         return "N/A"
@@ -229,164 +463,335 @@ def company_careers_search_link(company_name: str) -> str:
     return "https://www.google.com/search?q=" + urllib.parse.quote_plus(q)
 
 
-def normalize_row(job: Dict[str, Any]) -> Dict[str, str]:
-    job_id = job.get("job_id") or "N/A"
-
-    title = job.get("title") or "N/A"
-    company = job.get("company_name") or "N/A"
-    location = job.get("location") or "N/A"
-    source = job.get("via") or "Unknown"
-
-    pay = safe_pay(job)
-    time_posted = safe_time_posted(job)
-    apply_link = safe_apply_link(job)
-    source_link = safe_source_link(job)
-
-    if job_id != "N/A" and (pay == "N/A" or time_posted == "N/A" or apply_link == "N/A" or source_link == "N/A"):
-        details = serpapi_google_jobs_listing(job_id)
-        if details:
-            if pay == "N/A":
-                pay = safe_pay_from_details(details) or pay
-            if time_posted == "N/A":
-                time_posted = safe_time_posted_from_details(details) or time_posted
-            if apply_link == "N/A":
-                apply_link = safe_apply_link_from_details(details) or apply_link
-            if source_link == "N/A":
-                source_link = safe_source_link_from_details(details) or source_link
-            if source == "Unknown":
-                source = details.get("via") or source
-
-    return {
-        "job_id": job_id,
-        "title": title,
-        "company_name": company,
-        "pay": pay if pay else "N/A",
-        "time_posted": time_posted if time_posted else "N/A",
-        "location": location,
-        "source": source,
-        "apply_link": apply_link if apply_link else "N/A",
-        "source_link": source_link if source_link else "N/A",
-        "company_careers_link": company_careers_search_link(company),
-    }
+@dataclass(slots=True)
+class JobRow:
+    job_id: str
+    title: str
+    company_name: str
+    pay: str
+    time_posted: str
+    location: str
+    source: str
+    apply_link: str
+    source_link: str
+    company_careers_link: str
+
+
+def normalize_row(job: Dict[str, Any], pay_and_time: Tuple[str, str]) -> JobRow:
+    # Coerce to str once here so the report writers can use fields as-is. pay_and_time is
+    # safe_pay_and_time_posted(job), already computed by main() for the age check.
+    get = job.get  # bound once; this runs for every kept job
+    job_id = str(get("job_id") or "N/A")
+
+    title = str(get("title") or "N/A")
+    company = str(get("company_name") or "N/A")
+    location = str(get("location") or "N/A")
+    source = str(get("via") or "Unknown")
+
+    pay, time_posted = pay_and_time
+    apply_link = str(safe_apply_link(job))
+    source_link = str(safe_source_link(job))
+
+    return JobRow(
+        job_id=job_id,
+        title=title,
+        company_name=company,
+        pay=pay if pay else "N/A",
+        time_posted=time_posted if time_posted else "N/A",
+        location=location,
+        source=source,
+        apply_link=apply_link if apply_link else "N/A",
+        source_link=source_link if source_link else "N/A",
+        company_careers_link=company_careers_search_link(company),
+    )
+
+
+def needs_details(row: JobRow) -> bool:
+    # Rows with a known age over 7 days never get here (main() rejects them before
+    # normalizing); unknown ages are enriched because the listing may supply posted_at
+    if row.job_id == "N/A":
+        return False
+    return "N/A" in (row.pay, row.time_posted, row.apply_link, row.source_link)
+
+
+def apply_details(row: JobRow, details: Dict[str, Any]):
+    if not details:
+        return
+    if row.pay == "N/A":
+        row.pay = safe_pay_from_details(details) or "N/A"
+    if row.time_posted == "N/A":
+        row.time_posted = safe_time_posted_from_details(details) or "N/A"
+    if row.apply_link == "N/A":
+        row.apply_link = str(safe_apply_link_from_details(details) or "N/A")
+    if row.source_link == "N/A":
+        row.source_link = str(safe_source_link_from_details(details) or "N/A")
+    if row.source == "Unknown":
+        row.source = str(details.get("via") or "Unknown")
+
+
+def map_until_deadline(fn, items: List[Any], deadline: float, default: Any) -> List[Any]:
+    # Like ThreadPoolExecutor.map (results in input order), but calls still queued at
+    # `deadline` (time.monotonic()) are cancelled and yield `default`. Calls already running
+    # are waited for so their results (and cache writes) are kept; fn should honour the
+    # deadline itself if it can run long.
+    if time.monotonic() >= deadline:
+        return [default] * len(items)
+    ex = ThreadPoolExecutor(max_workers=SERPAPI_CONCURRENCY)
+    futures = [ex.submit(fn, item) for item in items]
+    try:
+        wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
+    return [default if fut.cancelled() else fut.result() for fut in futures]
+
+
+def enrich_rows(rows: List[JobRow], deadline: float) -> None:
+    # Second phase: fetch listing details for incomplete rows concurrently
+    targets = [r for r in rows if needs_details(r)]
+    if not targets:
+        return
+
+    all_details = map_until_deadline(serpapi_google_jobs_listing, [r.job_id for r in targets], deadline, {})
+    for row, details in zip(targets, all_details):
+        apply_details(row, details)
+
+
+def _canonical_tokens(text: str, aliases: Dict[str, str]) -> str:
+    return " ".join(aliases.get(t, t) for t in _NON_ALNUM_RE.split(text.lower()) if t)
+
+
+def near_dup_key(job: Dict[str, Any]) -> str:
+    # Same posting re-listed with cosmetic title differences; location stays in the key
+    # because the same title at the same company in another city is a different job
+    return "|".join([
+        _canonical_tokens(str(job.get("title") or ""), _TITLE_ABBREVIATIONS),
+        _canonical_tokens(str(job.get("company_name") or ""), {}),
+        _canonical_tokens(str(job.get("location") or ""), {}),
+    ])
+
+
+def known_too_old(time_posted: str) -> bool:
+    # Only a posting age we can read counts; unknown ages are kept for enrichment
+    return time_posted != "N/A" and posted_days(time_posted) > 7
+
+
+def or_clause(terms: List[str]) -> str:
+    # Multi-word terms are quoted so they match as phrases
+    return "(" + " OR ".join(f'"{t}"' if " " in t else t for t in terms) + ")"
+
+
+def prune_redundant_roles(roles: List[str]) -> List[str]:
+    # A phrase query for "QA Manager" already matches "Senior QA Manager", so a role that contains
+    # another role as a whole-word phrase adds nothing. Word-level on purpose: "QA Manager" is a
+    # substring of "FSQA Manager" but Google does not match it there, so both are kept.
+    padded: Dict[str, str] = {}
+    for r in roles:
+        padded.setdefault(f" {' '.join(r.lower().split())} ", r)  # exact repeats: first wins
+    return [
+        r for p, r in padded.items()
+        if not any(o != p and o in p for o in padded)
+    ]
 
 
 def build_queries() -> List[str]:
-    queries = []
-    for role in ROLE_KEYWORDS:
-        queries.append(f'"{role}" food')
-        queries.append(f'"{role}" food manufacturing')
-        queries.append(f'"{role}" food processing')
-        queries.append(f'"{role}" HACCP')
-        queries.append(f'"{role}" SQF')
-        queries.append(f'"{role}" FSQA')
-    return queries
-
-
-def dedupe_by_job_id(rows: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    seen = set()
-    out = []
-    for row in rows:
-        key = row.get("job_id") or (row.get("title", "") + "|" + row.get("company_name", "") + "|" + row.get("location", ""))
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(row)
-    return out
-
-
-def create_excel(rows: List[Dict[str, str]], filename: str) -> str:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Jobs"
-
-    headers = [
-        "title",
-        "company_name",
-        "pay",
-        "time_posted",
-        "location",
-        "source",
-        "apply_link",
-        "source_link",
-        "company_careers_link",
+    roles = prune_redundant_roles(ROLE_KEYWORDS)
+    food_clause = or_clause(list(HINT_MODIFIERS))
+    return [
+        f"{or_clause(roles[i:i + ROLE_GROUP_SIZE])} {food_clause}"
+        for i in range(0, len(roles), ROLE_GROUP_SIZE)
     ]
-    ws.append(headers)
 
-    for r in rows:
-        ws.append([r.get(h, "N/A") for h in headers])
 
-    link_cols = {
-        "apply_link": headers.index("apply_link") + 1,
-        "source_link": headers.index("source_link") + 1,
-        "company_careers_link": headers.index("company_careers_link") + 1,
-    }
+def write_query_yield(stats: List[Tuple[str, int, int]], today: str, path: str):
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        if new_file:
+            w.writerow(["date", "query", "returned", "new_jobs"])
+        w.writerows([today, q, returned, new] for q, returned, new in stats)
+
+
+def job_key(job: Dict[str, Any]) -> str:
+    return job.get("job_id") or (
+        str(job.get("title") or "") + "|" + str(job.get("company_name") or "") + "|" + str(job.get("location") or "")
+    )
+
+
+def report_digest(rows: List[JobRow]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for r in sorted(rows, key=attrgetter("job_id")):
+        for part in (r.job_id, r.time_posted, r.apply_link):
+            h.update(part.encode())
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+def read_last_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def create_excel(rows: List[JobRow], filename: str) -> str:
+    # constant_memory flushes each row to disk as soon as the next one starts,
+    # so every cell is written exactly once, in row order
+    wb = xlsxwriter.Workbook(filename, {"constant_memory": True})
+    ws = wb.add_worksheet("Jobs")
+    link_format = wb.add_format({"font_color": "blue", "underline": 1})
 
-    for row_idx in range(2, ws.max_row + 1):
-        for _, col_idx in link_cols.items():
-            cell = ws.cell(row=row_idx, column=col_idx)
-            val = str(cell.value or "")
-            if val.startswith("http"):
-                cell.hyperlink = val
-                cell.font = Font(color="0000FF", underline="single")
+    ws.write_row(0, 0, REPORT_HEADERS)
 
-    wb.save(filename)
+    for row_idx, r in enumerate(rows, start=1):
+        # JobRow fields are always non-empty str ("N/A" when missing), so no coercion is needed
+        for col_idx, val in enumerate(report_values(r)):
+            # write_url refuses over-long or excess URLs (non-zero return); keep them as text
+            if col_idx in REPORT_LINK_COLUMNS and val.startswith("http"):
+                if ws.write_url(row_idx, col_idx, val, link_format) == 0:
+                    continue
+            ws.write_string(row_idx, col_idx, val)
+
+    wb.close()
+    return filename
+
+
+def create_csv_gz(rows: List[JobRow], filename: str) -> str:
+    with gzip.open(filename, "wt", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(REPORT_HEADERS)
+        w.writerows(map(report_values, rows))
     return filename
 
 
-def send_email_with_attachment(subject: str, body: str, attachment_path: str):
+def smtp_login() -> smtplib.SMTP_SSL:
+    server = smtplib.SMTP_SSL("smtp.gmail.com", 465, context=SMTP_SSL_CONTEXT, timeout=SMTP_TIMEOUT)
+    try:
+        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def send_messages(batch: List[Tuple[EmailMessage, List[str]]], server: Optional[smtplib.SMTP_SSL] = None):
+    # One TLS session and login for every message in the batch; pass an already
+    # logged-in server to skip the handshake here
+    with server or smtp_login() as server:
+        for msg, recipients in batch:
+            server.send_message(msg, to_addrs=recipients)
+
+
+def send_email_with_attachment(
+    subject: str, body: str, attachment_path: str, recipients: List[str], server: Optional[smtplib.SMTP_SSL] = None
+):
     msg = EmailMessage()
     msg["From"] = EMAIL_SENDER
-    msg["To"] = ", ".join(EMAIL_RECEIVERS)   # ✅ sends to 2 emails
+    msg["To"] = EMAIL_SENDER
+    msg["Bcc"] = ", ".join(recipients)   # ✅ receivers don't see each other
     msg["Subject"] = subject
     msg.set_content(body)
 
+    # The raw bytes are only referenced for the duration of add_attachment, which base64-encodes
+    # them into the message; no second copy stays alive until the send
     with open(attachment_path, "rb") as f:
-        data = f.read()
+        msg.add_attachment(
+            f.read(),
+            maintype="application",
+            subtype=ATTACHMENT_SUBTYPES.get(os.path.splitext(attachment_path)[1], "octet-stream"),
+            filename=os.path.basename(attachment_path),
+        )
 
-    msg.add_attachment(
-        data,
-        maintype="application",
-        subtype="vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename=os.path.basename(attachment_path),
-    )
-
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-        server.send_message(msg)
+    send_messages([(msg, recipients)], server)
 
 
 def main():
     validate_env()
-
-    all_rows: List[Dict[str, str]] = []
-
-    for q in build_queries():
-        jobs = serpapi_google_jobs(q, LOCATION, num=50)
+    deadline = time.monotonic() + MAX_RUNTIME_SECONDS
+
+    # Raw jobs keyed by job_id, with their (pay, time_posted); the first query to return a job wins
+    raw_by_id: Dict[str, Tuple[Dict[str, Any], Tuple[str, str]]] = {}
+    # Every key already scanned, kept or not, so repeats skip the description scan
+    checked = set()
+    # Canonical title|company|location of every kept job, to drop near-duplicates with new ids
+    kept_signatures = set()
+    query_stats: List[Tuple[str, int, int]] = []
+
+    # First phase: run every query concurrently, results come back in query order
+    queries = build_queries()
+    results = map_until_deadline(
+        lambda q: serpapi_google_jobs(q, LOCATION, num=50, pages=MAX_PAGES, deadline=deadline), queries, deadline, []
+    )
+    for q, jobs in zip(queries, results):
+        new_jobs = 0
         for job in jobs:
-            if looks_food_industry(job):
-                all_rows.append(normalize_row(job))
-
-    all_rows = dedupe_by_job_id(all_rows)
-    all_rows = [r for r in all_rows if posted_days(r.get("time_posted", "N/A")) <= 7]
-    all_rows.sort(key=lambda r: posted_days(r.get("time_posted", "N/A")))
+            key = job_key(job)
+            if key in checked:
+                continue
+            checked.add(key)
+            # Cheap cached age check first, then the description scan. The extensions walk
+            # runs once here and its result is reused by normalize_row.
+            pay_and_time = safe_pay_and_time_posted(job)
+            if known_too_old(pay_and_time[1]) or not looks_food_industry(job):
+                continue
+            signature = near_dup_key(job)
+            if signature in kept_signatures:
+                continue
+            kept_signatures.add(signature)
+            raw_by_id[key] = (job, pay_and_time)
+            new_jobs += 1
+        query_stats.append((q, len(jobs), new_jobs))
+
+    # Only unique jobs get normalized and enriched
+    all_rows = [normalize_row(job, pay_and_time) for job, pay_and_time in raw_by_id.values()]
+    enrich_rows(all_rows, deadline)
+    # map_until_deadline has waited for every call it started, so no cache insert lands after this
+    cache_commit()
+
+    # Parse each posting age once and reuse it for both the filter and the sort
+    aged = [(posted_days(r.time_posted), r) for r in all_rows]
+    aged = [pair for pair in aged if pair[0] <= 7]
+    total_found = len(aged)
+    # Top-K instead of a full sort; same order as sorted(...)[:K], ties keep query order
+    aged = heapq.nsmallest(REPORT_MAX_ROWS, aged, key=itemgetter(0))
+    all_rows = [r for _, r in aged]
 
     today = datetime.now().strftime("%Y-%m-%d")
-    excel_file = f"food_quality_jobs_{today}.xlsx"
-    create_excel(all_rows, excel_file)
+    write_query_yield(query_stats, today, QUERY_YIELD_LOG)
+
+    digest = report_digest(all_rows)
+    if digest == read_last_digest(REPORT_HASH_PATH):
+        print("Report unchanged since the last run; skipping email.")
+        return
+
+    # The SMTP handshake and login run in the background while the report file is built
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        login = ex.submit(smtp_login)
+        try:
+            if OUTPUT_FORMAT == "csv":
+                report_file = create_csv_gz(all_rows, f"food_quality_jobs_{today}.csv.gz")
+            else:
+                report_file = create_excel(all_rows, f"food_quality_jobs_{today}.xlsx")
+        except Exception:
+            # Don't leave a logged-in session open behind the original error
+            if login.exception() is None:
+                login.result().close()
+            raise
 
     subject = f"Daily Food Quality Jobs Report - {today}"
+    shown = f" (newest {len(all_rows)} attached)" if len(all_rows) < total_found else ""
     body = f"""Hi,
 
 Attached is your daily Food Industry Quality/FSQA job report (last 7 days).
-Total jobs found: {len(all_rows)}
-
-Receivers: {", ".join(EMAIL_RECEIVERS)}
+Total jobs found: {total_found}{shown}
 
 Regards,
 Job Bot
 """
-    send_email_with_attachment(subject, body, excel_file)
+    send_email_with_attachment(subject, body, report_file, EMAIL_RECEIVERS, login.result())
+
+    with open(REPORT_HASH_PATH, "w", encoding="utf-8") as f:
+        f.write(digest)
 
 
 if __name__ == "__main__":